@@ -26,11 +26,13 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
+from apps.dc_algorithm.mask_utils import accumulate_clear_counts, count_clear_per_acquisition, count_valid
 
 from utils.data_cube_utilities.dc_mosaic import create_mosaic
 
 import datetime
 import numpy as np
+import pandas as pd
 import xarray as xr
 
 
@@ -99,35 +101,54 @@ class Query(BaseQuery):
         def clear_percentage(dataset_in, clean_mask, intermediate_product=None, no_data=-9999):
             """Calculate the total number of clear pixels and the total number of pixels
 
+            The totals are kept as plain numpy arrays while iterating - use clear_percentage_to_dataset
+            to create the xarray dataset once all timeslices have been processed.
+
             Args:
                 dataset_in: input dataset - must have time dimension.
                 clean_mask: numpy boolean mask of the same shape as data
                 intermediate_product: optional intermediate - can do one timeslice at a time.
 
             Returns:
-                xarray dataset with total_pixels, total_clear, clear_percentage
+                dict with total_pixels and total_clear numpy arrays and the latitude/longitude coords
             """
-            num_acq = len(dataset_in.time)
-            num_clear = np.sum(clean_mask.astype(np.int8), axis=0)
+            # uint16 holds up to 65535 acquisitions per pixel, half the memory of uint32 counters.
             if intermediate_product is None:
-                intermediate_product = xr.Dataset(
-                    {
-                        'total_pixels': (('latitude', 'longitude'), np.full(num_clear.shape, num_acq)),
-                        'total_clear': (('latitude', 'longitude'), num_clear)
-                    },
-                    coords={'latitude': dataset_in.latitude,
-                            'longitude': dataset_in.longitude})
-                intermediate_product[
-                    'clear_percentage'] = intermediate_product.total_clear / intermediate_product.total_pixels
-                return intermediate_product
-
-            intermediate_product['total_pixels'] += num_acq
-            intermediate_product['total_clear'] += num_clear
-            intermediate_product[
-                'clear_percentage'] = intermediate_product.total_clear / intermediate_product.total_pixels
+                intermediate_product = {
+                    'total_pixels': np.zeros(clean_mask.shape[1:], dtype=np.uint16),
+                    'total_clear': np.zeros(clean_mask.shape[1:], dtype=np.uint16),
+                    'latitude': dataset_in.latitude,
+                    'longitude': dataset_in.longitude
+                }
+
+            accumulate_clear_counts(clean_mask, intermediate_product['total_clear'],
+                                    intermediate_product['total_pixels'])
             return intermediate_product
 
-        return create_mosaic, clear_percentage
+        def clear_percentage_to_dataset(intermediate_product):
+            """Create an xarray dataset from the totals generated by clear_percentage
+
+            Args:
+                intermediate_product: dict returned by clear_percentage
+
+            Returns:
+                xarray dataset with total_pixels, total_clear, clear_percentage
+            """
+            total_pixels = intermediate_product['total_pixels']
+            total_clear = intermediate_product['total_clear']
+            clear_percentage = np.empty(total_clear.shape, dtype=np.float32)
+            # uint16 / uint16 resolves to the float64 loop - request float32 to divide in single precision.
+            np.divide(total_clear, total_pixels, out=clear_percentage, dtype=np.float32)
+            return xr.Dataset(
+                {
+                    'total_pixels': (('latitude', 'longitude'), total_pixels),
+                    'total_clear': (('latitude', 'longitude'), total_clear),
+                    'clear_percentage': (('latitude', 'longitude'), clear_percentage)
+                },
+                coords={'latitude': intermediate_product['latitude'],
+                        'longitude': intermediate_product['longitude']})
+
+        return create_mosaic, clear_percentage, clear_percentage_to_dataset
 
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
@@ -148,16 +169,15 @@ class Query(BaseQuery):
         query_data['description'] = "None" if 'description' not in form_data or form_data[
             'description'] == '' else form_data['description']
 
-        valid_query_fields = [field.name for field in cls._meta.get_fields()]
-        query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
+        valid_query_fields = cls._get_valid_field_names()
+        query_data = {key: value for key, value in query_data.items() if key in valid_query_fields}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
+        query = cls.objects.filter(pixel_drill_task=pixel_drill, **query_data).first()
+        if query is not None:
             return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        query = cls(pixel_drill_task=pixel_drill, **query_data)
+        query.save()
+        return query, True
 
 
 class Metadata(BaseMetadata):
@@ -178,20 +198,37 @@ class Metadata(BaseMetadata):
     def metadata_from_dataset(self, metadata, dataset, clear_mask, parameters):
         """implements metadata_from_dataset as required by the base class
 
+        Unlike the base class, the metadata dict is keyed by acquisition time as int milliseconds since
+        the epoch rather than by datetime - the keys are converted to dates once in metadata_from_dict.
         See the base metadata class docstring for more information.
+
+        Args:
+            metadata: existing metadata dict keyed by int milliseconds since the epoch
+            dataset: xarray dataset
+            clear_mask: boolean mask
+            parameters: parameters used to load the dataset - unused
+
+        Returns:
+            metadata dict keyed by int milliseconds since the epoch
         """
-        for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
-            if time not in metadata:
-                metadata[time] = {}
-                metadata[time]['clean_pixels'] = 0
-            metadata[time]['clean_pixels'] += clean_pixels
+        times = dataset.time.values.astype('M8[ms]').astype(np.int64).tolist()
+        # count the clear pixels of every acquisition in a single pass over the mask.
+        clean_pixels = count_clear_per_acquisition(clear_mask).tolist()
+        for time, time_clean_pixels in zip(times, clean_pixels):
+            metadata.setdefault(time, {'clean_pixels': 0})['clean_pixels'] += time_clean_pixels
         return metadata
 
     def combine_metadata(self, old, new):
         """implements combine_metadata as required by the base class
 
         See the base metadata class docstring for more information.
+
+        Args:
+            old: metadata dict keyed by int milliseconds since the epoch, updated in place
+            new: metadata dict keyed by int milliseconds since the epoch
+
+        Returns:
+            the combined metadata dict keyed by int milliseconds since the epoch
         """
         for key in new:
             if key in old:
@@ -205,8 +242,9 @@ class Metadata(BaseMetadata):
 
         See the base metadata class docstring for more information.
         """
-        self.pixel_count = len(dataset.latitude) * len(dataset.longitude)
-        self.clean_pixel_count = np.sum(dataset[list(dataset.data_vars)[0]].values != -9999)
+        self.pixel_count = dataset.sizes['latitude'] * dataset.sizes['longitude']
+        data = dataset[next(iter(dataset.data_vars))].values
+        self.clean_pixel_count = count_valid(data, no_data=-9999)
         self.percentage_clean_pixels = (self.clean_pixel_count / self.pixel_count) * 100
         self.save()
 
@@ -214,15 +252,21 @@ class Metadata(BaseMetadata):
         """implements metadata_from_dict as required by the base class
 
         See the base metadata class docstring for more information.
+
+        Args:
+            metadata_dict: metadata dict keyed by int milliseconds since the epoch, as generated by
+                metadata_from_dataset
         """
         dates = list(metadata_dict.keys())
         dates.sort(reverse=True)
         self.total_scenes = len(dates)
         self.scenes_processed = len(dates)
-        self.acquisition_list = ",".join([date.strftime("%m/%d/%Y") for date in dates])
-        self.clean_pixels_per_acquisition = ",".join([str(metadata_dict[date]['clean_pixels']) for date in dates])
+        self.acquisition_list = ",".join(pd.to_datetime(dates, unit='ms').strftime("%m/%d/%Y"))
+        clean_pixels = np.fromiter(
+            (metadata_dict[date]['clean_pixels'] for date in dates), dtype=np.int64, count=len(dates))
+        self.clean_pixels_per_acquisition = ",".join(clean_pixels.astype(str))
         self.clean_pixel_percentages_per_acquisition = ",".join(
-            [str((metadata_dict[date]['clean_pixels'] * 100) / self.pixel_count) for date in dates])
+            [str(percentage) for percentage in clean_pixels * 100 / self.pixel_count])
         self.save()
 
 
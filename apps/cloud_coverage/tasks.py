@@ -230,6 +230,7 @@ def processing_task(self,
     iteration_data = None
     cloud_cover = None
     metadata = {}
+    mosaic, cloud_coverage, cloud_coverage_to_dataset = task.get_processing_method()
 
     def _get_datetime_range_containing(*time_ranges):
         return (min(time_ranges) - timedelta(microseconds=1), max(time_ranges) + timedelta(microseconds=1))
@@ -256,7 +257,6 @@ def processing_task(self,
 
         if check_cancel_task(self, task): return
 
-        mosaic, cloud_coverage = task.get_processing_method()
         iteration_data = mosaic(
             data,
             clean_mask=clear_mask,
@@ -274,7 +274,7 @@ def processing_task(self,
     if iteration_data is None:
         return None
 
-    full_product = xr.merge([iteration_data, cloud_cover])
+    full_product = xr.merge([iteration_data, cloud_coverage_to_dataset(cloud_cover)])
 
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
     full_product.to_netcdf(path)
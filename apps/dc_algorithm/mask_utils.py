@@ -0,0 +1,82 @@
+import numpy as np
+
+# numba is an unsupported opt-in - it isn't part of the pinned requirements, so deployments use the
+# numpy path below. When it is installed the clear counts are accumulated by a compiled kernel that is
+# parallelized over latitude and releases the GIL.
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+
+    @njit(parallel=True, nogil=True, cache=True)
+    def _accumulate_clear_counts(clean_mask, total_clear, total_pixels, num_acq):
+        num_times, num_lat, num_lon = clean_mask.shape
+        # longitude is the innermost loop so both the mask and the totals are read contiguously.
+        for lat_index in prange(num_lat):
+            for time_index in range(num_times):
+                for lon_index in range(num_lon):
+                    total_clear[lat_index, lon_index] += clean_mask[time_index, lat_index, lon_index]
+            for lon_index in range(num_lon):
+                total_pixels[lat_index, lon_index] += num_acq
+else:
+    _accumulate_clear_counts = None
+
+
+def count_clear_per_pixel(clean_mask):
+    """Count the number of clear acquisitions for each pixel
+
+    Args:
+        clean_mask: numpy boolean mask in the shape (time, latitude, longitude)
+
+    Returns:
+        2d uint32 numpy array in the shape (latitude, longitude) containing the number of clear acquisitions
+    """
+    # summing the mask as uint8 into a uint32 accumulator is faster than count_nonzero,
+    # which accumulates booleans into intp.
+    # No tiling or time-last transpose: iterative tasks pass one acquisition per call, so there is no
+    # reuse across time to exploit and both were measured slower than a single reduction.
+    return np.add.reduce(clean_mask.view(np.uint8), axis=0, dtype=np.uint32)
+
+
+def accumulate_clear_counts(clean_mask, total_clear, total_pixels):
+    """Add the clear acquisition counts and the total acquisition counts of a mask to running totals
+
+    Args:
+        clean_mask: numpy boolean mask in the shape (time, latitude, longitude)
+        total_clear: 2d numpy array of clear acquisitions per pixel, updated in place
+        total_pixels: 2d numpy array of total acquisitions per pixel, updated in place
+    """
+    num_acq = clean_mask.shape[0]
+    if _accumulate_clear_counts is not None:
+        _accumulate_clear_counts(clean_mask.view(np.uint8), total_clear, total_pixels, num_acq)
+        return
+    total_pixels += num_acq
+    np.add(total_clear, count_clear_per_pixel(clean_mask), out=total_clear, casting='unsafe')
+
+
+def count_clear_per_acquisition(clean_mask):
+    """Count the number of clear pixels in each acquisition
+
+    Args:
+        clean_mask: numpy boolean mask with time as the first dimension
+
+    Returns:
+        1d numpy array with the number of clear pixels for each acquisition
+    """
+    clean_mask = clean_mask.reshape(clean_mask.shape[0], -1)
+    return np.count_nonzero(clean_mask, axis=1)
+
+
+def count_valid(data, no_data=-9999):
+    """Count the number of values in an array that are not equal to the no data value
+
+    Args:
+        data: numpy array of any shape
+        no_data: no data value to exclude from the count
+
+    Returns:
+        int containing the number of valid values
+    """
+    return int(np.count_nonzero(data != no_data))
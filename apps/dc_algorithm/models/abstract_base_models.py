@@ -203,6 +203,21 @@ class Query(models.Model):
         queryset_pks = [user_history_entry.task_id for user_history_entry in user_history]
         return cls.objects.filter(pk__in=queryset_pks, **kwargs)
 
+    @classmethod
+    def _get_valid_field_names(cls):
+        """Get the names of all fields on the model, used to filter post data
+
+        The names are cached on the class the first time they're requested. The cache is looked up
+        in the class __dict__ so that a subclass never reuses the field names of its parent.
+
+        Returns:
+            frozenset of field names
+
+        """
+        if '_valid_field_names' not in cls.__dict__:
+            cls._valid_field_names = frozenset(field.name for field in cls._meta.get_fields())
+        return cls._valid_field_names
+
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
         """Get or create a query obj from post form data
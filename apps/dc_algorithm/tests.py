@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase
+from unittest import mock, skipIf
+
+import numpy as np
+
+from apps.dc_algorithm import mask_utils
+
+
+class AccumulateClearCountsTestCase(SimpleTestCase):
+    """Checks accumulate_clear_counts against a plain sum for both the numba and numpy paths"""
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.clean_mask = random_state.rand(3, 70, 90) > 0.5
+        # every other longitude, so the mask isn't contiguous.
+        self.non_contiguous_mask = (random_state.rand(2, 70, 180) > 0.5)[:, :, ::2]
+
+    def _check_accumulate_clear_counts(self):
+        total_clear = np.zeros((70, 90), dtype=np.uint16)
+        total_pixels = np.zeros((70, 90), dtype=np.uint16)
+        mask_utils.accumulate_clear_counts(self.clean_mask, total_clear, total_pixels)
+        mask_utils.accumulate_clear_counts(self.non_contiguous_mask, total_clear, total_pixels)
+
+        expected_clear = self.clean_mask.sum(0) + self.non_contiguous_mask.sum(0)
+        np.testing.assert_array_equal(total_clear, expected_clear)
+        np.testing.assert_array_equal(total_pixels, np.full((70, 90), 5))
+
+    @skipIf(mask_utils._accumulate_clear_counts is None, "numba is not installed")
+    def test_accumulate_clear_counts_numba(self):
+        self._check_accumulate_clear_counts()
+
+    def test_accumulate_clear_counts_numpy(self):
+        with mock.patch.object(mask_utils, '_accumulate_clear_counts', None):
+            self._check_accumulate_clear_counts()
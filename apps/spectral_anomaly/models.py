@@ -26,12 +26,14 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
+from apps.dc_algorithm.mask_utils import count_clear_per_acquisition, count_valid
 
 from utils.data_cube_utilities.dc_mosaic import (create_mosaic, create_median_mosaic, create_max_ndvi_mosaic,
                                                  create_min_ndvi_mosaic)
 
 from datetime import datetime, timedelta
 import numpy as np
+import pandas as pd
 
 
 class UserHistory(BaseUserHistory):
@@ -165,16 +167,15 @@ class Query(BaseQuery):
         query_data['description'] = "None" if 'description' not in form_data or form_data[
             'description'] == '' else form_data['description']
 
-        valid_query_fields = [field.name for field in cls._meta.get_fields()]
-        query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
+        valid_query_fields = cls._get_valid_field_names()
+        query_data = {key: value for key, value in query_data.items() if key in valid_query_fields}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
+        query = cls.objects.filter(pixel_drill_task=pixel_drill, **query_data).first()
+        if query is not None:
             return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        query = cls(pixel_drill_task=pixel_drill, **query_data)
+        query.save()
+        return query, True
 
 
 class Metadata(BaseMetadata):
@@ -196,15 +197,25 @@ class Metadata(BaseMetadata):
     def metadata_from_dataset(self, metadata, dataset, clear_mask, parameters):
         """implements metadata_from_dataset as required by the base class
 
+        Unlike the base class, the metadata dict is keyed by acquisition time as int milliseconds since
+        the epoch rather than by datetime - the keys are converted to dates once in metadata_from_dict.
         See the base metadata class docstring for more information.
 
+        Args:
+            metadata: existing metadata dict keyed by int milliseconds since the epoch
+            dataset: xarray dataset
+            clear_mask: boolean mask
+            parameters: parameters used to load the dataset - unused
+
+        Returns:
+            metadata dict keyed by int milliseconds since the epoch
+
         """
-        for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
-            if time not in metadata:
-                metadata[time] = {}
-                metadata[time]['clean_pixels'] = 0
-            metadata[time]['clean_pixels'] += clean_pixels
+        times = dataset.time.values.astype('M8[ms]').astype(np.int64).tolist()
+        # count the clear pixels of every acquisition in a single pass over the mask.
+        clean_pixels = count_clear_per_acquisition(clear_mask).tolist()
+        for time, time_clean_pixels in zip(times, clean_pixels):
+            metadata.setdefault(time, {'clean_pixels': 0})['clean_pixels'] += time_clean_pixels
         return metadata
 
     def combine_metadata(self, old, new):
@@ -212,6 +223,13 @@ class Metadata(BaseMetadata):
 
         See the base metadata class docstring for more information.
 
+        Args:
+            old: metadata dict keyed by int milliseconds since the epoch, updated in place
+            new: metadata dict keyed by int milliseconds since the epoch
+
+        Returns:
+            the combined metadata dict keyed by int milliseconds since the epoch
+
         """
         for key in new:
             if key in old:
@@ -226,8 +244,9 @@ class Metadata(BaseMetadata):
         See the base metadata class docstring for more information.
 
         """
-        self.pixel_count = len(dataset.latitude) * len(dataset.longitude)
-        self.clean_pixel_count = np.sum(dataset[list(dataset.data_vars)[0]].values != -9999)
+        self.pixel_count = dataset.sizes['latitude'] * dataset.sizes['longitude']
+        data = dataset[next(iter(dataset.data_vars))].values
+        self.clean_pixel_count = count_valid(data, no_data=-9999)
         self.percentage_clean_pixels = (self.clean_pixel_count / self.pixel_count) * 100
         self.save()
 
@@ -236,15 +255,21 @@ class Metadata(BaseMetadata):
 
         See the base metadata class docstring for more information.
 
+        Args:
+            metadata_dict: metadata dict keyed by int milliseconds since the epoch, as generated by
+                metadata_from_dataset
+
         """
         dates = list(metadata_dict.keys())
         dates.sort(reverse=True)
         self.total_scenes = len(dates)
         self.scenes_processed = len(dates)
-        self.acquisition_list = ",".join([date.strftime("%m/%d/%Y") for date in dates])
-        self.clean_pixels_per_acquisition = ",".join([str(metadata_dict[date]['clean_pixels']) for date in dates])
+        self.acquisition_list = ",".join(pd.to_datetime(dates, unit='ms').strftime("%m/%d/%Y"))
+        clean_pixels = np.fromiter(
+            (metadata_dict[date]['clean_pixels'] for date in dates), dtype=np.int64, count=len(dates))
+        self.clean_pixels_per_acquisition = ",".join(clean_pixels.astype(str))
         self.clean_pixel_percentages_per_acquisition = ",".join(
-            [str((metadata_dict[date]['clean_pixels'] * 100) / self.pixel_count) for date in dates])
+            [str(percentage) for percentage in clean_pixels * 100 / self.pixel_count])
         self.save()
 
 